@@ -4,10 +4,14 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 
 from utils import overlap_and_add
 
 EPS = 1e-8
+# torch.compiler.is_compiling() only exists since torch 2.3
+is_compiling = getattr(getattr(torch, 'compiler', None), 'is_compiling',
+                       lambda: False)
 
 
 class ConvTasNet(nn.Module):
@@ -51,7 +55,10 @@ class ConvTasNet(nn.Module):
         """
         mixture_w = self.encoder(mixture)
         est_mask = self.separator(mixture_w)
-        est_source = self.decoder(mixture_w, est_mask)
+        # est_mask is not used after decoding, so without autograd the
+        # decoder may overwrite it instead of allocating the product
+        est_source = self.decoder(mixture_w, est_mask,
+                                  inplace=not torch.is_grad_enabled())
 
         # T changed after conv1d in encoder, fix it here
         T_origin = mixture.size(-1)
@@ -125,19 +132,28 @@ class Decoder(nn.Module):
         # Components
         self.basis_signals = nn.Linear(N, L, bias=False)
 
-    def forward(self, mixture_w, est_mask):
+    def forward(self, mixture_w, est_mask, inplace=False):
         """
         Args:
             mixture_w: [M, N, K]
             est_mask: [M, C, N, K]
+            inplace: write W * M into est_mask instead of a new tensor,
+                est_mask is overwritten and must not require grad
         Returns:
             est_source: [M, C, T]
         """
+        # Work in [M, K, C, N] order, which is how the separator stores
+        # est_mask, so N is innermost for the Linear and no copy is needed
+        est_mask = est_mask.permute(0, 3, 1, 2)  # [M, K, C, N]
+        mixture_w = mixture_w.transpose(1, 2).unsqueeze(2)  # [M, K, 1, N]
         # D = W * M
-        source_w = torch.unsqueeze(mixture_w, 1) * est_mask  # [M, C, N, K]
-        source_w = torch.transpose(source_w, 2, 3) # [M, C, K, N]
+        if inplace:
+            source_w = est_mask.mul_(mixture_w)  # [M, K, C, N]
+        else:
+            source_w = est_mask * mixture_w  # [M, K, C, N]
         # S = DV
-        est_source = self.basis_signals(source_w)  # [M, C, K, L]
+        est_source = self.basis_signals(source_w)  # [M, K, C, L]
+        est_source = est_source.permute(0, 2, 1, 3).contiguous()  # [M, C, K, L]
         est_source = overlap_and_add(est_source, self.L//2) # M x C x T
         return est_source
 
@@ -162,11 +178,16 @@ class TemporalConvNet(nn.Module):
         # Hyper-parameter
         self.C = C
         self.mask_nonlinear = mask_nonlinear
+        # Recompute each TemporalBlock in backward instead of keeping its
+        # activations, trades compute for memory in training
+        self.grad_checkpoint = False
         # Components
         # [M, N, K] -> [M, N, K]
         layer_norm = ChannelwiseLayerNorm(N)
         # [M, N, K] -> [M, B, K]
-        bottleneck_conv1x1 = nn.Conv1d(N, B, 1, bias=False)
+        # From here on activations are stored channels-last (see
+        # ChannelsLastConv1d), cLN already returns them in that layout
+        bottleneck_conv1x1 = ChannelsLastConv1d(N, B, 1, bias=False)
         # [M, B, K] -> [M, B, K]
         repeats = []
         for r in range(R):
@@ -182,7 +203,7 @@ class TemporalConvNet(nn.Module):
             repeats += [nn.Sequential(*blocks)]
         temporal_conv_net = nn.Sequential(*repeats)
         # [M, B, K] -> [M, C*N, K]
-        mask_conv1x1 = nn.Conv1d(B, C*N, 1, bias=False)
+        mask_conv1x1 = ChannelsLastConv1d(B, C*N, 1, bias=False)
         # Put together
         self.network = nn.Sequential(layer_norm,
                                      bottleneck_conv1x1,
@@ -198,10 +219,22 @@ class TemporalConvNet(nn.Module):
             est_mask: [M, C, N, K]
         """
         M, N, K = mixture_w.size()
-        score = self.network(mixture_w)  # [M, N, K] -> [M, C*N, K]
+        if self.grad_checkpoint and self.training:
+            layer_norm, bottleneck_conv1x1, temporal_conv_net, mask_conv1x1 = \
+                self.network
+            score = bottleneck_conv1x1(layer_norm(mixture_w))  # [M, B, K]
+            for repeat in temporal_conv_net:
+                for block in repeat:
+                    score = checkpoint(block, score, use_reentrant=False)
+            score = mask_conv1x1(score)  # [M, B, K] -> [M, C*N, K]
+        else:
+            score = self.network(mixture_w)  # [M, N, K] -> [M, C*N, K]
         score = score.view(M, self.C, N, K) # [M, C*N, K] -> [M, C, N, K]
         if self.mask_nonlinear == 'softmax':
-            est_mask = F.softmax(score, dim=1)
+            # score is stored as [M, K, C, N], softmax over C on that
+            # (contiguous) permuted view keeps the layout instead of copying
+            est_mask = F.softmax(score.float().permute(0, 3, 1, 2), dim=2)
+            est_mask = est_mask.permute(0, 2, 3, 1)  # [M, C, N, K]
         elif self.mask_nonlinear == 'relu':
             est_mask = F.relu(score)
         else:
@@ -214,7 +247,7 @@ class TemporalBlock(nn.Module):
                  stride, padding, dilation, norm_type="gLN", causal=False):
         super(TemporalBlock, self).__init__()
         # [M, B, K] -> [M, H, K]
-        conv1x1 = nn.Conv1d(in_channels, out_channels, 1, bias=False)
+        conv1x1 = ChannelsLastConv1d(in_channels, out_channels, 1, bias=False)
         prelu = nn.PReLU()
         norm = chose_norm(norm_type, out_channels)
         # [M, H, K] -> [M, B, K]
@@ -242,25 +275,36 @@ class DepthwiseSeparableConv(nn.Module):
     def __init__(self, in_channels, out_channels, kernel_size,
                  stride, padding, dilation, norm_type="gLN", causal=False):
         super(DepthwiseSeparableConv, self).__init__()
+        # Causal conv only pads on the left, done in forward so that the
+        # output is already [M, H, K] and nothing needs to be chomped
+        self.causal_padding = padding if causal else 0
         # Use `groups` option to implement depthwise convolution
         # [M, H, K] -> [M, H, K]
-        depthwise_conv = nn.Conv1d(in_channels, in_channels, kernel_size,
-                                   stride=stride, padding=padding,
-                                   dilation=dilation, groups=in_channels,
-                                   bias=False)
-        if causal:
-            chomp = Chomp1d(padding)
+        depthwise_conv = ChannelsLastConv1d(in_channels, in_channels,
+                                            kernel_size, stride=stride,
+                                            padding=0 if causal else padding,
+                                            dilation=dilation,
+                                            groups=in_channels, bias=False)
         prelu = nn.PReLU()
         norm = chose_norm(norm_type, in_channels)
         # [M, H, K] -> [M, B, K]
-        pointwise_conv = nn.Conv1d(in_channels, out_channels, 1, bias=False)
+        pointwise_conv = ChannelsLastConv1d(in_channels, out_channels, 1,
+                                            bias=False)
         # Put together
-        if causal:
-            self.net = nn.Sequential(depthwise_conv, chomp, prelu, norm,
-                                     pointwise_conv)
-        else:
-            self.net = nn.Sequential(depthwise_conv, prelu, norm,
-                                     pointwise_conv)
+        self.net = nn.Sequential(depthwise_conv, prelu, norm, pointwise_conv)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Causal models used to have a parameter-free Chomp1d at net.1, so
+        # their checkpoints keep prelu, norm and pointwise_conv at net.2/3/4
+        net = prefix + 'net.'
+        if self.causal_padding and net + '4.weight' in state_dict:
+            for index in (2, 3, 4):
+                old = '{}{}.'.format(net, index)
+                new = '{}{}.'.format(net, index - 1)
+                for key in [k for k in state_dict if k.startswith(old)]:
+                    state_dict[new + key[len(old):]] = state_dict.pop(key)
+        super(DepthwiseSeparableConv, self)._load_from_state_dict(
+            state_dict, prefix, *args, **kwargs)
 
     def forward(self, x):
         """
@@ -269,24 +313,102 @@ class DepthwiseSeparableConv(nn.Module):
         Returns:
             result: [M, B, K]
         """
-        return self.net(x)
-
-
-class Chomp1d(nn.Module):
-    """To ensure the output length is the same as the input.
+        if self.causal_padding:
+            # pad as 4-D so that the channels-last layout is kept
+            x = F.pad(x.unsqueeze(2), (self.causal_padding, 0)).squeeze(2)
+        depthwise_conv, prelu, norm, pointwise_conv = self.net
+        if isinstance(norm, nn.BatchNorm1d):
+            return self.net(x)  # [M, H, K + padding] -> [M, B, K]
+        y = prelu(depthwise_conv(x))  # [M, H, K + padding] -> [M, H, K]
+        return norm_pointwise(y, norm, pointwise_conv)
+
+
+def norm_pointwise(y, norm, pointwise_conv):
+    """pointwise_conv(norm(y)) for gLN and cLN without computing norm(y).
+
+    With y_hat = (y - mean) * rstd, the 1x1 conv W of gamma * y_hat + beta
+    is (W gamma) y * rstd - (W gamma) 1 * mean * rstd + W beta, so gamma is
+    folded into the conv weight and the statistics are applied to the
+    [M, B, K] output instead of the larger normalized [M, H, K] tensor.
+    Args:
+        y: [M, H, K]
+        norm: GlobalLayerNorm or ChannelwiseLayerNorm
+        pointwise_conv: 1x1 conv, H -> B
+    Returns:
+        [M, B, K]
+    """
+    H = y.size(1)
+    # The folded conv is un-centered, so it must stay in fp32 like the
+    # statistics: rounding (W gamma) y to bf16 before subtracting the mean
+    # term would lose precision growing with |mean| / std
+    y = y.float()
+    with torch.autocast(y.device.type, enabled=False):
+        if isinstance(norm, GlobalLayerNorm):
+            var, mean = torch.var_mean(y, dim=(1, 2), keepdim=True,
+                                       unbiased=False)  # [M, 1, 1]
+        else:
+            var, mean = torch.var_mean(y, dim=1, keepdim=True,
+                                       unbiased=False)  # [M, 1, K]
+        rstd = torch.rsqrt(var + EPS)
+        weight = pointwise_conv.weight.view(-1, H)  # [B, H]
+        weight_gamma = weight * norm.gamma.view(1, H)  # [B, H]
+        bias = torch.mv(weight, norm.beta.view(H))  # [B]
+        out = F.linear(y.transpose(1, 2), weight_gamma).transpose(1, 2)  # [M, B, K]
+        out = out * rstd
+        out.addcmul_(weight_gamma.sum(dim=1).view(1, -1, 1), mean * rstd,
+                     value=-1)
+        return out.add_(bias.view(1, -1, 1))
+
+
+class ChannelsLastConv1d(nn.Conv1d):
+    """nn.Conv1d computed on channels-last memory.
+
+    nn.Conv1d makes its input contiguous, so an [M, C, K] tensor stored as
+    [M, K, C] would be copied back before every conv. Here it is viewed as
+    an [M, C, 1, K] channels_last tensor (no copy) and run through conv2d,
+    which selects the NHWC kernels, notably for the depthwise conv. The
+    output keeps the same layout. Parameters are those of nn.Conv1d.
     """
-    def __init__(self, chomp_size):
-        super(Chomp1d, self).__init__()
-        self.chomp_size = chomp_size
-
     def forward(self, x):
         """
         Args:
-            x: [M, H, Kpad]
+            x: [M, Cin, Kin]
+        Returns:
+            [M, Cout, Kout], stored channels-last
+        """
+        if (is_compiling() and self.stride == (1,)
+                and self.groups == self.in_channels == self.out_channels):
+            return self.depthwise_taps(x)
+        x = x.unsqueeze(2).contiguous(memory_format=torch.channels_last)
+        out = F.conv2d(x, self.weight.unsqueeze(2), self.bias,
+                       (1,) + self.stride, (0,) + self.padding,
+                       (1,) + self.dilation, self.groups)
+        return out.squeeze(2)
+
+    def depthwise_taps(self, x):
+        """Depthwise conv written as a sum over the P kernel taps.
+
+        Used under torch.compile only: the loop is unrolled at trace time with
+        this block's dilation baked in, so Inductor generates P fused
+        multiply-adds specialized to it (and fuses them with the following
+        PReLU) instead of calling a generic grouped conv.
+        Args:
+            x: [M, H, Kin]
         Returns:
-            [M, H, K]
+            [M, H, Kout]
         """
-        return x[:, :, :-self.chomp_size].contiguous()
+        P, dilation, padding = (self.kernel_size[0], self.dilation[0],
+                                self.padding[0])
+        if padding:
+            x = F.pad(x, (padding, padding))
+        K = x.size(-1) - dilation * (P - 1)
+        weight = self.weight.squeeze(1)  # [H, P]
+        out = x[:, :, :K] * weight[:, :1]
+        for p in range(1, P):
+            out = out + x[:, :, p*dilation:p*dilation + K] * weight[:, p:p+1]
+        if self.bias is not None:
+            out = out + self.bias.unsqueeze(1)
+        return out
 
 
 def chose_norm(norm_type, channel_size):
@@ -303,7 +425,6 @@ def chose_norm(norm_type, channel_size):
         return nn.BatchNorm1d(channel_size)
 
 
-# TODO: Use nn.LayerNorm to impl cLN to speed up
 class ChannelwiseLayerNorm(nn.Module):
     """Channel-wise Layer Normalization (cLN)"""
     def __init__(self, channel_size):
@@ -323,10 +444,12 @@ class ChannelwiseLayerNorm(nn.Module):
         Returns:
             cLN_y: [M, N, K]
         """
-        mean = torch.mean(y, dim=1, keepdim=True)  # [M, 1, K]
-        var = torch.var(y, dim=1, keepdim=True, unbiased=False)  # [M, 1, K]
-        cLN_y = self.gamma * (y - mean) / torch.pow(var + EPS, 0.5) + self.beta
-        return cLN_y
+        N = y.size(1)
+        # F.layer_norm normalizes the trailing dims, so move N to the end
+        cLN_y = F.layer_norm(y.float().transpose(1, 2), (N,),
+                             self.gamma.view(N), self.beta.view(N),
+                             eps=EPS)  # [M, K, N]
+        return cLN_y.transpose(1, 2)
 
 
 class GlobalLayerNorm(nn.Module):
@@ -348,10 +471,12 @@ class GlobalLayerNorm(nn.Module):
         Returns:
             gLN_y: [M, N, K]
         """
-        # TODO: in torch 1.0, torch.mean() support dim list
-        mean = y.mean(dim=1, keepdim=True).mean(dim=2, keepdim=True) #[M, 1, 1]
-        var = (torch.pow(y-mean, 2)).mean(dim=1, keepdim=True).mean(dim=2, keepdim=True)
-        gLN_y = self.gamma * (y - mean) / torch.pow(var + EPS, 0.5) + self.beta
+        # One pass for the statistics, then gamma * (y - mean) * rstd + beta
+        # is applied as a single y * scale + shift with small [M, N, 1] terms
+        var, mean = torch.var_mean(y.float(), dim=(1, 2), keepdim=True,
+                                   unbiased=False)  # [M, 1, 1]
+        scale = self.gamma * torch.rsqrt(var + EPS)  # [M, N, 1]
+        gLN_y = torch.addcmul(self.beta - mean * scale, y, scale)
         return gLN_y
 
 
@@ -360,10 +485,52 @@ if __name__ == "__main__":
     M, N, L, T = 2, 3, 4, 12
     K = 2*T//L-1
     B, H, P, X, R, C, norm_type, causal = 2, 3, 3, 3, 2, 2, "gLN", False
-    mixture = torch.randint(3, (M, T))
+
+    # check DepthwiseSeparableConv (left padding, norm folded into the
+    # pointwise conv) and gLN/cLN against the original formulation:
+    # padded depthwise conv -> chomp -> prelu -> norm -> pointwise conv
+    Mc, Hc, Bc, Kc, dilation = 3, 8, 5, 16, 2
+    with torch.no_grad():
+        for check_norm in ["gLN", "cLN", "BN"]:
+            for check_causal in [False, True]:
+                padding = (P - 1) * dilation if check_causal \
+                    else (P - 1) * dilation // 2
+                block = DepthwiseSeparableConv(Hc, Bc, P, 1, padding,
+                                               dilation, norm_type=check_norm,
+                                               causal=check_causal)
+                block.eval()
+                depthwise_conv, prelu, norm, pointwise_conv = block.net
+                for param in block.parameters():
+                    param.uniform_(-1, 1)
+                if check_norm == "BN":
+                    norm.running_mean.uniform_(-1, 1)
+                    norm.running_var.uniform_(0.5, 2)
+                # a non-zero mean exercises the centering of the fold
+                x = torch.randn(Mc, Hc, Kc) + 2
+                y = F.conv1d(x, depthwise_conv.weight, padding=padding,
+                             dilation=dilation, groups=Hc)
+                if check_causal:
+                    y = y[:, :, :-padding]
+                y = prelu(y)
+                if check_norm == "BN":
+                    y_norm = norm(y)
+                else:
+                    dims = (1, 2) if check_norm == "gLN" else 1
+                    mean = y.mean(dim=dims, keepdim=True)
+                    var = ((y - mean)**2).mean(dim=dims, keepdim=True)
+                    y_norm = norm.gamma * (y - mean) / torch.sqrt(var + EPS) \
+                        + norm.beta
+                    assert torch.allclose(norm(y), y_norm, atol=1e-5), \
+                        check_norm
+                expected = F.conv1d(y_norm, pointwise_conv.weight)
+                assert torch.allclose(block(x), expected, atol=1e-4), \
+                    (check_norm, check_causal)
+    print('DepthwiseSeparableConv matches the reference')
+
+    mixture = torch.randint(3, (M, T)).float()
     # test Encoder
     encoder = Encoder(L, N)
-    encoder.conv1d_U.weight.data = torch.randint(2, encoder.conv1d_U.weight.size())
+    encoder.conv1d_U.weight.data = torch.randint(2, encoder.conv1d_U.weight.size()).float()
     mixture_w = encoder(mixture)
     print('mixture', mixture)
     print('U', encoder.conv1d_U.weight)
@@ -377,9 +544,20 @@ if __name__ == "__main__":
 
     # test Decoder
     decoder = Decoder(N, L)
-    est_mask = torch.randint(2, (B, K, C, N))
+    est_mask = torch.randint(2, (M, C, N, K)).float()
     est_source = decoder(mixture_w, est_mask)
     print('est_source', est_source)
+    with torch.no_grad():
+        # original formulation: D = W * M as [M, C, N, K], then S = DV
+        source_w = torch.unsqueeze(mixture_w, 1) * est_mask
+        expected = overlap_and_add(
+            decoder.basis_signals(torch.transpose(source_w, 2, 3)), L // 2)
+        assert torch.allclose(decoder(mixture_w, est_mask), expected,
+                              atol=1e-5)
+        assert torch.allclose(
+            decoder(mixture_w, est_mask.clone(), inplace=True), expected,
+            atol=1e-5)
+    print('Decoder matches the reference')
 
     # test Conv-TasNet
     conv_tasnet = ConvTasNet(N, L, B, H, P, X, R, C, norm_type=norm_type)
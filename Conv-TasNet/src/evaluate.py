@@ -30,6 +30,11 @@ parser.add_argument('--sample_rate', default=8000, type=int,
                     help='Sample rate')
 parser.add_argument('--batch_size', default=1, type=int,
                     help='Batch size')
+parser.add_argument('--bf16', type=int, default=0,
+                    help='Whether run the model in bfloat16 autocast (needs '
+                         'Ampere+ GPU or AVX512-BF16/AMX CPU)')
+parser.add_argument('--compile', type=int, default=0,
+                    help='Whether compile the separator with torch.compile')
 
 
 def evaluate(args):
@@ -43,13 +48,23 @@ def evaluate(args):
     model.eval()
     if args.use_cuda:
         model.cuda()
+    if args.compile:
+        # Fuse the conv/norm/activation blocks of the TCN. Utterances have
+        # different lengths, so compile for dynamic shapes once instead of
+        # recompiling (and re-autotuning) per length, and skip CUDA graphs,
+        # which would be recorded again for every distinct length
+        model.separator = torch.compile(model.separator,
+                                        mode='max-autotune-no-cudagraphs',
+                                        dynamic=True, fullgraph=True)
 
     # Load data
     dataset = AudioDataset(args.data_dir, args.batch_size,
                            sample_rate=args.sample_rate, segment=-1)
     data_loader = AudioDataLoader(dataset, batch_size=1, num_workers=2)
 
-    with torch.no_grad():
+    device_type = 'cuda' if args.use_cuda else 'cpu'
+    with torch.no_grad(), torch.autocast(device_type, dtype=torch.bfloat16,
+                                         enabled=bool(args.bf16)):
         for i, (data) in enumerate(data_loader):
             # Get batch data
             padded_mixture, mixture_lengths, padded_source = data
@@ -58,7 +73,7 @@ def evaluate(args):
                 mixture_lengths = mixture_lengths.cuda()
                 padded_source = padded_source.cuda()
             # Forward
-            estimate_source = model(padded_mixture)  # [B, C, T]
+            estimate_source = model(padded_mixture).float()  # [B, C, T]
             loss, max_snr, estimate_source, reorder_estimate_source = \
                 cal_loss(padded_source, estimate_source, mixture_lengths)
             # Remove padding and flat
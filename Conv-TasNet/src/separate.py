@@ -30,6 +30,11 @@ parser.add_argument('--sample_rate', default=8000, type=int,
                     help='Sample rate')
 parser.add_argument('--batch_size', default=1, type=int,
                     help='Batch size')
+parser.add_argument('--bf16', type=int, default=0,
+                    help='Whether run the model in bfloat16 autocast (needs '
+                         'Ampere+ GPU or AVX512-BF16/AMX CPU)')
+parser.add_argument('--compile', type=int, default=0,
+                    help='Whether compile the separator with torch.compile')
 
 
 def separate(args):
@@ -43,6 +48,14 @@ def separate(args):
     model.eval()
     if args.use_cuda:
         model.cuda()
+    if args.compile:
+        # Fuse the conv/norm/activation blocks of the TCN. Utterances have
+        # different lengths, so compile for dynamic shapes once instead of
+        # recompiling (and re-autotuning) per length, and skip CUDA graphs,
+        # which would be recorded again for every distinct length
+        model.separator = torch.compile(model.separator,
+                                        mode='max-autotune-no-cudagraphs',
+                                        dynamic=True, fullgraph=True)
 
     # Load data
     eval_dataset = EvalDataset(args.mix_dir, args.mix_json,
@@ -55,14 +68,16 @@ def separate(args):
         librosa.output.write_wav(filename, inputs, sr)# norm=True)
         
 
-    with torch.no_grad():
+    device_type = 'cuda' if args.use_cuda else 'cpu'
+    with torch.no_grad(), torch.autocast(device_type, dtype=torch.bfloat16,
+                                         enabled=bool(args.bf16)):
         for (i, data) in enumerate(eval_loader):
             # Get batch data
             mixture, mix_lengths, filenames = data
             if args.use_cuda:
                 mixture, mix_lengths = mixture.cuda(), mix_lengths.cuda()
             # Forward
-            estimate_source = model(mixture)  # [B, C, T]
+            estimate_source = model(mixture).float()  # [B, C, T]
             # Remove padding and flat
             flat_estimate = remove_pad(estimate_source, mix_lengths)
             mixture = remove_pad(mixture, mix_lengths)
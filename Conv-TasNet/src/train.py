@@ -61,6 +61,10 @@ parser.add_argument('--early_stop', dest='early_stop', default=0, type=int,
                     help='Early stop training when no improvement for 10 epochs')
 parser.add_argument('--max_norm', default=5, type=float,
                     help='Gradient norm threshold to clip')
+parser.add_argument('--grad_checkpoint', default=0, type=int,
+                    help='Recompute separator blocks in backward to save memory '
+                         '(not with BN, its running statistics would be '
+                         'updated twice per step)')
 # minibatch
 parser.add_argument('--shuffle', default=0, type=int,
                     help='reshuffle the data at every epoch')
@@ -99,6 +103,9 @@ parser.add_argument('--visdom_id', default='TasNet training',
 
 
 def main(args):
+    if args.grad_checkpoint and args.norm_type == 'BN':
+        print("Not support grad_checkpoint with BN")
+        return
     # Construct Solver
     # data
     tr_dataset = AudioDataset(args.train_dir, args.batch_size,
@@ -117,6 +124,7 @@ def main(args):
     model = ConvTasNet(args.N, args.L, args.B, args.H, args.P, args.X, args.R,
                        args.C, norm_type=args.norm_type, causal=args.causal,
                        mask_nonlinear=args.mask_nonlinear)
+    model.separator.grad_checkpoint = bool(args.grad_checkpoint)
 
     print(model)
     if args.use_cuda:
@@ -37,8 +37,7 @@ def overlap_and_add(signal, frame_step):
     subframe_signal = signal.view(*outer_dimensions, -1, subframe_length)
 
     frame = torch.arange(0, output_subframes).unfold(0, subframes_per_frame, subframe_step)
-    frame = signal.new_tensor(frame).long()  # signal may in GPU or CPU
-    frame = frame.cuda()
+    frame = frame.to(signal.device)  # signal may in GPU or CPU
     # frame = frame.clone().detach()
     frame = frame.contiguous().view(-1)
 
@@ -1,19 +1,133 @@
+import math
 import os
+from multiprocessing import Pool
+import numpy as np
 import soundfile as sf
-import resampy
+import torch
+import torchaudio
+import tqdm
 
 path = "/home/cwc2022/soundSeparate/data/data_origin/archive/wavfiles"
 resamplePath = "/home/cwc2022/soundSeparate/data/data_resample/bird_resample"
 
-i = 0
 resample_fs = 8000
-# a = os.path.exists(path)
-for root, dirs, files in os.walk(path):
-    for file in files:
-        wavFile = os.path.join(root, file)
-        s1_16k, fs = sf.read(wavFile)
-        data = resampy.resample(s1_16k, fs, resample_fs )
-        mix_out_name = os.path.join(resamplePath, "resample_{}".format(file))
-        sf.write(mix_out, data, resample_fs , format='WAV', subtype='PCM_16')
-        i = i+1
-        print(i)
+batch_size = 256
+resamplers = {}
+
+
+def get_resampler(fs):
+    # the polyphase kernel only depends on (fs, resample_fs), build it once
+    if fs not in resamplers:
+        resamplers[fs] = torchaudio.transforms.Resample(
+            fs, resample_fs, resampling_method="sinc_interp_kaiser")
+    return resamplers[fs]
+
+
+def list_wav_files(root):
+    # os.scandir gets the file type from the directory listing itself,
+    # unlike os.walk no extra stat call is needed per entry. Like os.walk,
+    # symlinked directories are not followed
+    for entry in os.scandir(root):
+        if entry.is_dir(follow_symlinks=False):
+            yield from list_wav_files(entry.path)
+        elif entry.name.lower().endswith('.wav'):
+            yield entry.path
+
+
+def get_out_name(wavFile):
+    return os.path.join(
+        resamplePath, "resample_{}".format(os.path.basename(wavFile)))
+
+
+def to_pcm16(data):
+    # convert once here instead of letting sf.write make a float64 copy
+    # round like libsndfile does, astype alone would truncate toward zero
+    return np.clip(np.rint(data * 32767.0), -32768, 32767).astype(np.int16)
+
+
+def read_mono(wavFile):
+    s1_16k, fs = sf.read(wavFile, dtype='float32')
+    # the resampler works on the last axis, which is channels for [L, ch]
+    if s1_16k.ndim != 1:
+        raise ValueError("{} is not mono".format(wavFile))
+    return s1_16k, fs
+
+
+def resample_one(wavFile):
+    s1_16k, fs = read_mono(wavFile)
+    wav = torch.from_numpy(s1_16k).unsqueeze(0)
+    data = get_resampler(fs)(wav).squeeze(0).numpy()
+    sf.write(get_out_name(wavFile), to_pcm16(data), resample_fs,
+             format='WAV', subtype='PCM_16')
+
+
+def load_batch(wavFiles):
+    signals = [read_mono(wavFile)[0] for wavFile in wavFiles]
+    lengths = [len(s) for s in signals]
+    # pinned so that the host to device copy can run asynchronously
+    wav = torch.zeros(len(signals), max(lengths), pin_memory=True)
+    for i, s in enumerate(signals):
+        wav[i, :lengths[i]] = torch.from_numpy(s)
+    return wav, lengths
+
+
+def write_batch(wavFiles, data, lengths, fs):
+    # quantize to int16 on the GPU, this also halves the copy back
+    data = data.mul(32767.0).round().clamp(-32768, 32767).to(torch.int16)
+    data = data.cpu().numpy()
+    for wavFile, s, length in zip(wavFiles, data, lengths):
+        out_length = math.ceil(length * resample_fs / fs)
+        sf.write(get_out_name(wavFile), s[:out_length], resample_fs,
+                 format='WAV', subtype='PCM_16')
+
+
+def resample_batch_cuda(wavFiles, fs):
+    """Resample files sharing the sample rate fs on GPU, batch_size at a time.
+    Reading the next batch and copying it to the GPU overlaps with the
+    resampling of the current one.
+    """
+    resampler = torchaudio.transforms.Resample(
+        fs, resample_fs, resampling_method="sinc_interp_kaiser").cuda()
+    copy_stream = torch.cuda.Stream()
+    pending = None
+    with torch.no_grad():
+        for start in tqdm.trange(0, len(wavFiles), batch_size):
+            batch = wavFiles[start:start + batch_size]
+            wav, lengths = load_batch(batch)
+            with torch.cuda.stream(copy_stream):
+                wav = wav.cuda(non_blocking=True)
+            if pending is not None:
+                write_batch(*pending, fs)
+            torch.cuda.current_stream().wait_stream(copy_stream)
+            wav.record_stream(torch.cuda.current_stream())
+            pending = (batch, resampler(wav), lengths)
+        if pending is not None:
+            write_batch(*pending, fs)
+
+
+if __name__ == '__main__':
+    # files resampled by an earlier run are skipped, so a re-run only
+    # processes what is missing
+    os.makedirs(resamplePath, exist_ok=True)
+    done = {entry.name for entry in os.scandir(resamplePath)}
+    wavFiles = [wavFile for wavFile in list_wav_files(path)
+                if "resample_{}".format(os.path.basename(wavFile)) not in done]
+
+    if torch.cuda.is_available():
+        # one resampler per source rate, so group the files by it first
+        groups = {}
+        for wavFile in wavFiles:
+            info = sf.info(wavFile)
+            groups.setdefault(info.samplerate, []).append(
+                (info.frames, wavFile))
+        for fs, group in groups.items():
+            # batches are padded to their longest file, sorting by length
+            # keeps a single long recording from inflating a whole batch
+            resample_batch_cuda([wavFile for _, wavFile in sorted(group)], fs)
+    else:
+        # every file is resampled independently, so spread them over all cores
+        with Pool(os.cpu_count(), initializer=torch.set_num_threads,
+                  initargs=(1,)) as p:
+            list(tqdm.tqdm(p.imap_unordered(resample_one, wavFiles,
+                                            chunksize=16),
+                           total=len(wavFiles)))
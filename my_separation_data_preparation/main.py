@@ -3,6 +3,7 @@ import random
 import numpy as np
 import argparse
 import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import soundfile as sf
 from activlev import activlev
 import tqdm
@@ -11,26 +12,44 @@ from test2_mydata import GenerateMixAudio
 from test3_mydata import GenrateCroValScp, GenrateTestScp, GenrateTrainScp
 
 
+def PrepareData(input_dir_transformer, input_dir_bird, output_dir, dataPath,
+                nums_file, state, useActive, seed):
+    # forked workers inherit the parent's random state, without their own
+    # seed train and test would draw the same shuffles, pairs and SNRs
+    random.seed(seed)
+    np.random.seed(seed)
+    CreateFiles(input_dir_transformer, input_dir_bird,
+                output_dir, nums_file, state)
+    print("create file down")
+    GenerateMixAudio(dataPath, state, useActive)
+    print("Generate MixAudio down")
+    return state
+
+
 if __name__ == '__main__':
     output_dir = "/home/cwc2022/soundSeparate/data/dataset_fs8000"
-    state = "train"
     nums_file = 10000
     useActive = False
+    seeds = {"train": 1, "test": 2}
     input_dir_transformer = "/home/cwc2022/soundSeparate/data/data_resample/transformer_resample"
     input_dir_bird = "/home/cwc2022/soundSeparate/data/data_resample/bird_resample"
-    CreateFiles(input_dir_transformer, input_dir_bird,
-                output_dir, nums_file, state)
-    print("create file down")
     dataPath = "/home/cwc2022/soundSeparate/data/dataset_fs8000"
-    GenerateMixAudio(dataPath, state, useActive)
-    print("Generate MixAudio down")
-    state = "test"
-    CreateFiles(input_dir_transformer, input_dir_bird,
-                output_dir, nums_file, state)
-    print("create file down")
-    GenerateMixAudio(dataPath, state, useActive)
-    print("Generate MixAudio down")
-    GenrateTrainScp(dataPath)
-    GenrateTestScp(dataPath)
-    GenrateCroValScp(dataPath)
+    # train and test write to different subdirs, so they can run side by
+    # side; the scp lists of a state are written as soon as it is done
+    scpGenerators = {"train": [GenrateTrainScp, GenrateCroValScp],
+                     "test": [GenrateTestScp]}
+    with ProcessPoolExecutor(max_workers=2) as processPool, \
+            ThreadPoolExecutor(max_workers=3) as threadPool:
+        futures = [processPool.submit(PrepareData, input_dir_transformer,
+                                      input_dir_bird, output_dir, dataPath,
+                                      nums_file, state, useActive,
+                                      seeds[state])
+                   for state in ["train", "test"]]
+        scpFutures = []
+        for future in as_completed(futures):
+            state = future.result()
+            scpFutures += [threadPool.submit(GenrateScp, dataPath)
+                           for GenrateScp in scpGenerators[state]]
+        for future in as_completed(scpFutures):
+            future.result()
     print("all done")
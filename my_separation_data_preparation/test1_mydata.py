@@ -10,8 +10,7 @@ def CreateFiles(input_dir_transformer, input_dir_bird, output_dir, nums_file, st
     wavList_transformer = []
     wavList_bird = []
     mix_files = os.path.join(output_dir, 'mix_files')
-    if not os.path.exists(mix_files):
-        os.mkdir(mix_files)
+    os.makedirs(mix_files, exist_ok=True)
 
     for root, _, files in os.walk(input_dir_transformer):
         for file in files:
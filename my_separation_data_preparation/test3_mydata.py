@@ -9,8 +9,7 @@ def GenrateTrainScp(dataPath):
     train_s2 = os.path.join(dataPath, 'audio', 'tr', 's2')
 
     wav_scp_dir = os.path.join(dataPath, 'wav_scp')
-    if not os.path.exists(wav_scp_dir):
-        os.mkdir(wav_scp_dir)
+    os.makedirs(wav_scp_dir, exist_ok=True)
 
     train_mix_scp = os.path.join(wav_scp_dir, 'tr_mix.scp')
     train_s1_scp = os.path.join(wav_scp_dir, 'tr_s1.scp')
@@ -44,8 +43,7 @@ def GenrateTestScp(dataPath):
     test_s2 = os.path.join(dataPath, 'audio', 'tt', 's2')
 
     wav_scp_dir = os.path.join(dataPath, 'wav_scp')
-    if not os.path.exists(wav_scp_dir):
-        os.mkdir(wav_scp_dir)
+    os.makedirs(wav_scp_dir, exist_ok=True)
 
     test_mix_scp = os.path.join(wav_scp_dir, 'tt_mix.scp')
     test_s1_scp = os.path.join(wav_scp_dir, 'tt_s1.scp')
@@ -79,8 +77,7 @@ def GenrateCroValScp(dataPath):
     cv_s2 = os.path.join(dataPath, 'audio', 'cv', 's2')
 
     wav_scp_dir = os.path.join(dataPath, 'wav_scp')
-    if not os.path.exists(wav_scp_dir):
-        os.mkdir(wav_scp_dir)
+    os.makedirs(wav_scp_dir, exist_ok=True)
 
     cv_mix_scp = os.path.join(wav_scp_dir, 'cv_mix.scp')
     cv_s1_scp = os.path.join(wav_scp_dir, 'cv_s1.scp')